@@ -1,14 +1,14 @@
 """A1111 backend for Dreambot."""
 
-import base64
-import io
+import asyncio
 
 from typing import Any
 from argparse import REMAINDER, ArgumentError
 
 import aiohttp
+import orjson
+import pybase64
 
-from PIL import Image
 from dreambot.shared.custom_argparse import UsageException, ErrorCatchingArgumentParser
 from dreambot.shared.worker import DreambotWorkerBase, DreambotWorkerEndType, CallbackSendWorkload
 
@@ -35,14 +35,20 @@ class DreambotBackendA1111(DreambotWorkerBase):
         self.a1111_host = options["a1111"]["host"]
         self.a1111_port = options["a1111"]["port"]
         self.api_uri = f"http://{self.a1111_host}:{self.a1111_port}/sdapi/v1"
+        self.argparser = self.arg_parser()
+        # Reuse HTTP connections rather than paying for a new one on every request
+        self.http_session: aiohttp.ClientSession | None = None
 
     async def boot(self):
         """Boot the backend."""
         self.logger.info("A1111 API URI: %s", self.api_uri)
+        self.http_session = aiohttp.ClientSession(json_serialize=lambda obj: orjson.dumps(obj).decode())
         self.is_booted = True
 
     async def shutdown(self):
         """Shutdown the backend."""
+        if self.http_session:
+            await self.http_session.close()
 
     async def callback_receive_workload(self, queue_name: str, message: dict[str, Any]) -> bool:
         """Process in incoming workload message.
@@ -57,8 +63,7 @@ class DreambotBackendA1111(DreambotWorkerBase):
         self.logger.info("callback_receive_workload: %s", message)
 
         try:
-            argparser = self.arg_parser()
-            args = argparser.parse_args(message["prompt"].split(" "))
+            args = self.argparser.parse_args(message["prompt"].split(" "))
             args.prompt = " ".join(args.prompt)
 
             # Image URLs can arrive separately, so update args if we have one
@@ -75,7 +80,7 @@ class DreambotBackendA1111(DreambotWorkerBase):
                 if args.imgurl:
                     image = await self.fetch_image(args.imgurl)
                     post_url = f"{self.api_uri}/img2img"
-                    payload["init_images"] = [base64.b64encode(image.getvalue()).decode("utf8")]
+                    payload["init_images"] = [pybase64.b64encode(image).decode("ascii")]
 
                 self.logger.info(
                     "POSTing graph to A1111: %s :: %s",
@@ -83,18 +88,19 @@ class DreambotBackendA1111(DreambotWorkerBase):
                     {k: payload[k] for k in set(list(payload.keys())) - set(["init_images"])},
                 )
 
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(post_url, json=payload) as req:
-                        if not req.ok:
-                            message["error"] = f"Error from A1111: {req.reason}"  # type: ignore
-                            await self.send_message(message)
-                            return True
-                        response = await req.json()
-                        if "images" not in response:
-                            raise ImageFetchException("A1111 did not return any images")
-                        i = response["images"][0]
-                        # A1111 returns a base64 encoded image, so we can just send that as a reply
-                        message["reply-image"] = i.split(",", 1)[0]
+                async with self.http_session.post(post_url, json=payload) as req:  # type: ignore
+                    if not req.ok:
+                        message["error"] = f"Error from A1111: {req.reason}"  # type: ignore
+                        await self.send_message(message)
+                        return True
+                    # The response carries the whole image as base64, so hand the raw bytes straight to orjson
+                    # rather than having aiohttp decode it to a str for the stdlib json module first
+                    response = orjson.loads(await req.read())
+                    if "images" not in response:
+                        raise ImageFetchException("A1111 did not return any images")
+                    i = response["images"][0]
+                    # A1111 returns a base64 encoded image, so we can just send that as a reply
+                    message["reply-image"] = i.split(",", 1)[0]
         except UsageException as exc:
             # This isn't strictly an error, but it's the easiest way to reply with our --help text, which is in the UsageException
             message["reply-text"] = str(exc)
@@ -108,7 +114,7 @@ class DreambotBackendA1111(DreambotWorkerBase):
         await self.send_message(message)
         return True
 
-    async def fetch_image(self, url: str) -> io.BytesIO:
+    async def fetch_image(self, url: str) -> bytes:
         """Fetch an image from a URL.
 
         Args:
@@ -118,32 +124,20 @@ class DreambotBackendA1111(DreambotWorkerBase):
             ImageFetchException: Either the image could not be fetched, or the URL returned a non-image.
 
         Returns:
-            Tuple[str, io.BytesIO]: A tuple containing the MIME type of the image and a file-like object containing the image data.
+            bytes: The image, resized and encoded as a JPEG.
         """
         self.logger.info("Fetching image: %s", url)
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    raise ImageFetchException(f"Unable to fetch: {resp.status}")
-                if not resp.content_type.startswith("image/"):
-                    raise ImageFetchException(f"URL was not an image: {resp.content_type}")
-
-                image = await resp.read()
-                resp.close()
-                self.logger.info("Fetched %s bytes of %s", len(image), resp.content_type)
-
-                # Resize the image so it's not too big for our VRAM
-                resp_image = io.BytesIO()
-                thumbnail = Image.open(io.BytesIO(image))
-                if thumbnail.mode != "RGB":
-                    # Some images have weird colour modes, so convert them to RGB
-                    thumbnail = thumbnail.convert("RGB")
-                thumbnail.thumbnail((512, 512), Image.Resampling.LANCZOS)
-                thumbnail.save(resp_image, "JPEG")
-                resp_image.flush()
-                resp_image.seek(0)
-
-                return resp_image
+        async with self.http_session.get(url) as resp:  # type: ignore
+            if resp.status != 200:
+                raise ImageFetchException(f"Unable to fetch: {resp.status}")
+            if not resp.content_type.startswith("image/"):
+                raise ImageFetchException(f"URL was not an image: {resp.content_type}")
+
+            image = await resp.read()
+            self.logger.info("Fetched %s bytes of %s", len(image), resp.content_type)
+
+        # Decoding and resizing a large photo takes long enough to stall every other task on the event loop
+        return await asyncio.to_thread(self.resize_image, image)
 
     def arg_parser(self) -> ErrorCatchingArgumentParser:
         """Get an argument parser for this worker.
@@ -21,6 +21,7 @@ class DreambotBackendCommands(DreambotWorkerBase):
             options=options,
             callback_send_workload=callback_send_workload,
         )
+        self.argparsers: dict[str, ErrorCatchingArgumentParser] = {}
 
     async def boot(self):
         """Boot ourselves."""
@@ -44,8 +45,10 @@ class DreambotBackendCommands(DreambotWorkerBase):
         self.logger.info("callback_receive_workload: %s", message)
 
         try:
-            argparser = self.arg_parser(message["trigger"])
-            args = argparser.parse_args(message["prompt"].split(" "))
+            # Parsers only vary by trigger, so build each one once and reuse it
+            if message["trigger"] not in self.argparsers:
+                self.argparsers[message["trigger"]] = self.arg_parser(message["trigger"])
+            args = self.argparsers[message["trigger"]].parse_args(message["prompt"].split(" "))
             args.prompt = " ".join(args.prompt)
 
             # Determine which command was triggered
@@ -1,4 +1,7 @@
 """OpenAI GPT backend for Dreambot."""
+import asyncio
+import random
+import time
 import traceback
 
 from typing import Any
@@ -16,6 +19,9 @@ from openai.error import (
 from dreambot.shared.custom_argparse import UsageException, ErrorCatchingArgumentParser
 from dreambot.shared.worker import DreambotWorkerBase, DreambotWorkerEndType, CallbackSendWorkload
 
+# The initial 'system' prompt that starts every conversation, guiding GPT to behave the way we want
+SYSTEM_MESSAGE = {"role": "system", "content": "You are a helpful assistant. Make your answers as brief as possible."}
+
 
 class DreambotBackendGPT(DreambotWorkerBase):
     """OpenAI GPT backend for Dreambot."""
@@ -32,6 +38,16 @@ class DreambotBackendGPT(DreambotWorkerBase):
         self.organization = options["gpt"]["organization"]
         self.model = options["gpt"]["model"]
         self.conversation_cache: dict[str, Any] = {}
+        self.conversation_locks: dict[str, asyncio.Lock] = {}
+        # How many prompts NatsManager may have us working on at once, which also bounds our requests to OpenAI
+        self.max_concurrency = options["gpt"].get("max_concurrency", 8)
+        self.max_retries = options["gpt"].get("max_retries", 6)
+        # Total time we'll spend backing off from rate limits for one prompt. This must stay well below JetStream's ack
+        # window (30s by default), or the prompt is redelivered to another worker while we're still waiting.
+        self.max_retry_time: float = options["gpt"].get("max_retry_time", 20.0)
+        # Capping response length bounds how long OpenAI spends generating a reply
+        self.max_tokens: int | None = options["gpt"].get("max_tokens", None)
+        self.argparser = self.arg_parser()
 
     async def boot(self):
         """Boot the backend."""
@@ -56,36 +72,45 @@ class DreambotBackendGPT(DreambotWorkerBase):
         self.logger.info("callback_receive_workload: %s", message)
 
         try:
-            argparser = self.arg_parser()
-            args = argparser.parse_args(message["prompt"].split(" "))
+            args = self.argparser.parse_args(message["prompt"].split(" "))
             args.prompt = " ".join(args.prompt)
 
-            # Ensure we have a valid conversation cache for this user
-            cache_key = self.ensure_cache_for_user(message)
-
-            # Determine if we're adding to the cache or starting a new conversation
-            if not args.followup:
-                self.reset_cache(cache_key)
-
-            if args.list_models:
-                # We have to hard code this because the OpenAI API endpoint lists dozens of models that can't be used for Chat Completions
-                # see https://platform.openai.com/docs/models/model-endpoint-compatibility
-
-                models = ["gpt-4", "gpt-3.5-turbo", "gpt-3.5-turbo-0301"]
-                message["reply-text"] = ", ".join(models)  # type: ignore
-            else:
-                # Now that our cache is in the right state, add this new prompt to it
-                self.conversation_cache[cache_key].append({"role": "user", "content": args.prompt})
-
-                # Now we can ask OpenAI for a response to the contents of our message cache
-                self.logger.debug("Sending request to OpenAI...")
-                response = openai.ChatCompletion.create(model=args.model, messages=self.conversation_cache[cache_key], temperature=args.temperature)  # type: ignore
-
-                # Fetch the response, prepare it to be sent back to the user and added to their cache
-                message["reply-text"] = response.choices[0].message.content  # type: ignore
-
-            # Add the response to the user's cache
-            self.conversation_cache[cache_key].append({"role": "assistant", "content": message["reply-text"]})
+            # Prompts from the same user are handled one at a time, so each one sees the complete conversation so far
+            cache_key = self.cache_name_for_prompt(message)
+            async with self.conversation_locks.setdefault(cache_key, asyncio.Lock()):
+                # Ensure we have a valid conversation cache for this user
+                self.ensure_cache_for_user(message)
+
+                # Determine if we're adding to the cache or starting a new conversation
+                if not args.followup:
+                    self.reset_cache(cache_key)
+
+                if args.list_models:
+                    # We have to hard code this because the OpenAI API endpoint lists dozens of models that can't be used for Chat Completions
+                    # see https://platform.openai.com/docs/models/model-endpoint-compatibility
+
+                    models = ["gpt-4", "gpt-3.5-turbo", "gpt-3.5-turbo-0301"]
+                    message["reply-text"] = ", ".join(models)  # type: ignore
+                else:
+                    # Now that our cache is in the right state, add this new prompt to it
+                    self.conversation_cache[cache_key].append({"role": "user", "content": args.prompt})
+
+                    # Now we can ask OpenAI for a response to the contents of our message cache
+                    self.logger.debug("Sending request to OpenAI...")
+                    request: dict[str, Any] = {
+                        "model": args.model,
+                        "messages": self.conversation_cache[cache_key],
+                        "temperature": args.temperature,
+                    }
+                    if self.max_tokens:
+                        request["max_tokens"] = self.max_tokens
+                    response = await self.chat_completion(**request)
+
+                    # Fetch the response, prepare it to be sent back to the user and added to their cache
+                    message["reply-text"] = response.choices[0].message.content  # type: ignore
+
+                # Add the response to the user's cache
+                self.conversation_cache[cache_key].append({"role": "assistant", "content": message["reply-text"]})
         except UsageException as exc:
             # This isn't strictly an error, but it's the easiest way to reply with our --help text, which is in the UsageException
             message["reply-text"] = str(exc)
@@ -104,6 +129,49 @@ class DreambotBackendGPT(DreambotWorkerBase):
         await self.send_message(message)
         return True
 
+    async def chat_completion(self, **kwargs: Any) -> Any:
+        """Request a chat completion from OpenAI, backing off and retrying if we are rate limited.
+
+        Args:
+            **kwargs (Any): Arguments to pass to openai.ChatCompletion.acreate().
+
+        Raises:
+            RateLimitError: We were still being rate limited after `max_retries` attempts, or after `max_retry_time`.
+
+        Returns:
+            Any: The response from OpenAI.
+        """
+        deadline = time.monotonic() + self.max_retry_time
+        attempt = 0
+        while True:
+            try:
+                return await openai.ChatCompletion.acreate(**kwargs)  # type: ignore
+            except RateLimitError as exc:
+                attempt += 1
+                remaining = deadline - time.monotonic()
+                if attempt >= self.max_retries or remaining <= 0:
+                    raise
+                delay = min(self.retry_delay(exc, attempt), remaining)
+                self.logger.warning("OpenAI rate limit hit, retrying in %.1fs (attempt %s): %s", delay, attempt, exc)
+                await asyncio.sleep(delay)
+
+    def retry_delay(self, exc: RateLimitError, attempt: int) -> float:
+        """Determine how long to wait before retrying a rate limited request.
+
+        Args:
+            exc (RateLimitError): The exception raised by the OpenAI client.
+            attempt (int): How many attempts have been made so far.
+
+        Returns:
+            float: The number of seconds to wait, never more than `max_retry_time`.
+        """
+        try:
+            # OpenAI tells us how long to wait, if it can
+            delay = float(exc.headers["retry-after"])
+        except (KeyError, TypeError, ValueError):
+            delay = 2.0**attempt + random.uniform(0, 1)
+        return min(delay, self.max_retry_time)
+
     def ensure_cache_for_user(self, data: dict[str, Any]) -> str:
         """Ensure we have a cache entry for this user.
 
@@ -135,12 +203,8 @@ class DreambotBackendGPT(DreambotWorkerBase):
 
         This is where our initial 'system' prompt is set, which guides GPT to behave the way we want.
         """
-        self.conversation_cache[key] = [
-            {
-                "role": "system",
-                "content": "You are a helpful assistant. Make your answers as brief as possible.",
-            }
-        ]
+        # Each conversation gets its own copy, so changing one can never leak into another
+        self.conversation_cache[key] = [dict(SYSTEM_MESSAGE)]
 
     def arg_parser(self) -> ErrorCatchingArgumentParser:
         """Parse arguments that may be contained in a workload message.
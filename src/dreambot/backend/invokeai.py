@@ -1,21 +1,37 @@
 """InvokeAI backend for Dreambot."""
 
 import asyncio
-import base64
-import io
 
 from typing import Any, Tuple
 from argparse import REMAINDER, ArgumentError, Namespace
 
 import aiohttp
+import orjson
+import pybase64
 import requests
 import socketio
 
-from PIL import Image
+from requests.adapters import HTTPAdapter
+
 from dreambot.shared.custom_argparse import UsageException, ErrorCatchingArgumentParser
 from dreambot.shared.worker import DreambotWorkerBase, DreambotWorkerEndType, CallbackSendWorkload
 
 
+def json_serialize(obj: Any) -> str:
+    """Serialise an object to JSON for an InvokeAI API request.
+
+    Our graphs key their nodes by integer, which the stdlib json module would quietly turn into strings, so orjson
+    needs to be told to do the same.
+
+    Args:
+        obj (Any): The object to serialise.
+
+    Returns:
+        str: The JSON encoded object.
+    """
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
 class ImageFetchException(Exception):
     """Exception raised when we fail to fetch an image."""
 
@@ -36,6 +52,7 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
             callback_send_workload=callback_send_workload,
         )
         self.sio: socketio.Client
+        self.loop: asyncio.AbstractEventLoop | None = None
         self.invokeai_host = options["invokeai"]["host"]
         self.invokeai_port = options["invokeai"]["port"]
         self.request_cache: dict[str, Any] = {}
@@ -43,16 +60,29 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
         self.ws_uri = f"ws://{self.invokeai_host}:{self.invokeai_port}/"
         self.api_uri = f"http://{self.invokeai_host}:{self.invokeai_port}/api/v1/"
 
+        # Reuse HTTP connections rather than paying for a new one on every request.
+        # socket.io callbacks run on their own thread, so they get a synchronous session of their own.
+        self.http_session: aiohttp.ClientSession | None = None
+        self.sync_http_session = requests.Session()
+        self.sync_http_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
         # Set our default InvokeAI options
         self.model = "stable-diffusion-1.5"
         self.sampler = "keuler_a"
         self.steps = 50
         self.seed = -1
 
+        # Our parser only depends on the options above, so it can be built once and reused for every message
+        self.argparser = self.arg_parser()
+
     async def boot(self):
         """Boot the backend."""
         self.logger.info("InvokeAI API URI: %s, socket.io URI: %s", self.api_uri, self.ws_uri)
 
+        # socket.io events arrive on the client's own thread, replies are handed back to this loop
+        self.loop = asyncio.get_running_loop()
+        self.http_session = aiohttp.ClientSession(json_serialize=json_serialize)
+
         self.sio = socketio.Client(reconnection_delay_max=10)
         self.sio.on("connect", self.on_connect)  # type: ignore
         self.sio.on("disconnect", self.on_disconnect)  # type: ignore
@@ -66,6 +96,9 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
     async def shutdown(self):
         """Shutdown the backend."""
         self.sio.disconnect()  # type: ignore
+        if self.http_session:
+            await self.http_session.close()
+        self.sync_http_session.close()
 
     async def callback_receive_workload(self, queue_name: str, message: dict[str, Any]) -> bool:
         """Process in incoming workload message.
@@ -80,8 +113,7 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
         self.logger.info("callback_receive_workload: %s", message)
 
         try:
-            argparser = self.arg_parser()
-            args = argparser.parse_args(message["prompt"].split(" "))
+            args = self.argparser.parse_args(message["prompt"].split(" "))
             args.prompt = " ".join(args.prompt)
 
             # Image URLs can arrive separately, so update args if we have one
@@ -97,13 +129,12 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
 
             sessions_url = f"{self.api_uri}sessions/"
             self.logger.info("POSTing graph to InvokeAI: %s :: %s", sessions_url, graph)
-            async with aiohttp.ClientSession() as session:
-                async with session.post(sessions_url, json=graph) as req:
-                    if not req.ok:
-                        message["error"] = f"Error from InvokeAI: {req.reason}"  # type: ignore
-                        await self.send_message(message)
-                        return True
-                    response = await req.json()
+            async with self.http_session.post(sessions_url, json=graph) as req:  # type: ignore
+                if not req.ok:
+                    message["error"] = f"Error from InvokeAI: {req.reason}"  # type: ignore
+                    await self.send_message(message)
+                    return True
+                response = orjson.loads(await req.read())
 
             self.request_cache[response["id"]] = message
             self.logger.debug("InvokeAI response: %s", response)
@@ -111,12 +142,11 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
             self.logger.info("Subscribing to InvokeAI session and invoking: %s", response["id"])
             self.sio.emit("subscribe", {"session": response["id"]})  # type: ignore
 
-            async with aiohttp.ClientSession() as session:
-                async with session.put(f"{sessions_url}{response['id']}/invoke?all=true") as req:
-                    if not req.ok:
-                        message["error"] = f"Error from InvokeAI: {req.reason}"  # type: ignore
-                        await self.send_message(message)
-                        return True
+            async with self.http_session.put(f"{sessions_url}{response['id']}/invoke?all=true") as req:  # type: ignore
+                if not req.ok:
+                    message["error"] = f"Error from InvokeAI: {req.reason}"  # type: ignore
+                    await self.send_message(message)
+                    return True
 
             message["reply-none"] = "Waiting for InvokeAI to generate a response..."
         except UsageException as exc:
@@ -169,7 +199,9 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
             return
 
         data = self.last_completion[graph_id]
-        req = requests.get(f"{self.api_uri}images/results/{data['result']['image']['image_name']}", timeout=30)
+        req = self.sync_http_session.get(
+            f"{self.api_uri}images/results/{data['result']['image']['image_name']}", timeout=(3.05, 30)
+        )
         self.last_completion.pop(graph_id, None)
 
         if req.status_code != 200:
@@ -177,7 +209,7 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
             self.sync_send_reply(request)
             return
         else:
-            request["reply-image"] = base64.b64encode(req.content).decode("utf8")
+            request["reply-image"] = pybase64.b64encode(req.content).decode("ascii")
 
         self.logger.debug(
             "Sending image response to queue '%s': for %s <%s> %s",
@@ -194,9 +226,16 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
         Args:
             request (dict[str, Any]): A dictionary containing the message to send.
         """
-        loop = asyncio.new_event_loop()
-        loop.run_until_complete(self.callback_send_workload(request))
-        loop.close()
+        if not self.loop:
+            self.logger.error("Unable to send reply, no event loop available")
+            return
+
+        # Our NATS connection belongs to the main event loop, so the reply has to be sent from there
+        future = asyncio.run_coroutine_threadsafe(self.callback_send_workload(request), self.loop)
+        try:
+            future.result()
+        except Exception as exc:
+            self.logger.error("Failed to send reply: %s", exc)
 
     def on_invocation_error(self, data: dict[str, Any]):
         """Handle an invocation error from InvokeAI.
@@ -471,7 +510,7 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
         graph: dict[str, Any] = {"nodes": dict(enumerate(nodes)), "edges": links}
         return graph
 
-    async def fetch_image(self, url: str) -> Tuple[str, io.BytesIO]:
+    async def fetch_image(self, url: str) -> Tuple[str, bytes]:
         """Fetch an image from a URL.
 
         Args:
@@ -481,29 +520,20 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
             ImageFetchException: Either the image could not be fetched, or the URL returned a non-image.
 
         Returns:
-            Tuple[str, io.BytesIO]: A tuple containing the MIME type of the image and a file-like object containing the image data.
+            Tuple[str, bytes]: A tuple containing the MIME type of the image and the image data.
         """
         self.logger.info("Fetching image: %s", url)
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    raise ImageFetchException(f"Unable to fetch: {resp.status}")
-                if not resp.content_type.startswith("image/"):
-                    raise ImageFetchException(f"URL was not an image: {resp.content_type}")
-
-                image = await resp.read()
-                resp.close()
-                self.logger.info("Fetched %s bytes of %s", len(image), resp.content_type)
-
-                # Resize the image so it's not too big for our VRAM
-                resp_image = io.BytesIO()
-                thumbnail = Image.open(io.BytesIO(image))
-                thumbnail.thumbnail((512, 512), Image.Resampling.LANCZOS)
-                thumbnail.save(resp_image, "JPEG")
-                resp_image.flush()
-                resp_image.seek(0)
-
-                return ("image/jpeg", resp_image)
+        async with self.http_session.get(url) as resp:  # type: ignore
+            if resp.status != 200:
+                raise ImageFetchException(f"Unable to fetch: {resp.status}")
+            if not resp.content_type.startswith("image/"):
+                raise ImageFetchException(f"URL was not an image: {resp.content_type}")
+
+            image = await resp.read()
+            self.logger.info("Fetched %s bytes of %s", len(image), resp.content_type)
+
+        # Decoding and resizing a large photo takes long enough to stall every other task on the event loop
+        return ("image/jpeg", await asyncio.to_thread(self.resize_image, image))
 
     async def upload_image(self, url: str) -> Tuple[str, str]:
         """Fetch an image from an arbitrary URL and upload it to InvokeAI.
@@ -522,16 +552,13 @@ class DreambotBackendInvokeAI(DreambotWorkerBase):
         upload_url = self.api_uri + "images/uploads/"
 
         self.logger.info("Uploading image (%s) to InvokeAI: %s -> %s", content_type, url, upload_url)
-        files: dict[str, Tuple[str, io.BytesIO, str]] = {
-            "file": (image_name, image, content_type),
-        }
-        response = requests.post(
-            f"http://{self.invokeai_host}:{self.invokeai_port}/api/v1/images/uploads/", files=files, timeout=30
-        )
-        if not response.ok:
-            self.logger.error("Error uploading image to InvokeAI: %s", response.reason)
-            raise ImageFetchException(f"Error uploading image to InvokeAI: {response.reason}")
-        body = response.json()
+        form = aiohttp.FormData()
+        form.add_field("file", image, filename=image_name, content_type=content_type)
+        async with self.http_session.post(upload_url, data=form) as response:  # type: ignore
+            if not response.ok:
+                self.logger.error("Error uploading image to InvokeAI: %s", response.reason)
+                raise ImageFetchException(f"Error uploading image to InvokeAI: {response.reason}")
+            body = orjson.loads(await response.read())
         image_name = body["image_name"]
         image_type = body["image_type"]
         self.logger.info("Image uploaded as: %s (%s)", image_name, image_type)
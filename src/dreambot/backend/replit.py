@@ -2,9 +2,10 @@
 import asyncio
 import traceback
 
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
-from argparse import REMAINDER, ArgumentError
-from transformers import AutoModelForCausalLM, AutoTokenizer, set_seed  # type: ignore
+from argparse import REMAINDER, ArgumentError, Namespace
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, set_seed  # type: ignore
 
 import torch
 
@@ -24,19 +25,30 @@ class DreambotBackendReplit(DreambotWorkerBase):
             callback_send_workload=callback_send_workload,
         )
         self.hf_token = options["hugging_face_token"]
+        # "triton" selects Replit's fused FlashAttention kernel, which never materialises the full attention matrix.
+        # It requires the triton package, so the plain torch implementation remains the default.
+        self.attn_impl = options.get("replit_attn_impl", "torch")
         self.tokenizer = None
         self.model = None
+        # A single thread, so only one generation ever touches the model at a time
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="replit")
+        self.argparser = self.arg_parser()
 
     async def boot(self):
         """Boot our model on the GPU."""
+        # Let any fp32 matmuls that slip past bfloat16 (e.g. in sampling) use TF32 tensor cores
+        torch.set_float32_matmul_precision("high")
+
         self.logger.info("Loading tokenizer...")
         self.tokenizer = AutoTokenizer.from_pretrained("replit/replit-code-v1-3b", use_auth_token=self.hf_token, trust_remote_code=True)  # type: ignore
         self.tokenizer.truncation_side = "left"  # type: ignore
 
         await asyncio.sleep(0)  # Since our boot takes a long time, give asyncio a chance to run its tasks
 
-        self.logger.info("Loading model...")
-        self.model = AutoModelForCausalLM.from_pretrained("replit/replit-code-v1-3b", use_auth_token=self.hf_token, trust_remote_code=True).to("cuda", dtype=torch.bfloat16)  # type: ignore pylint: disable=no-member
+        self.logger.info("Loading model (attention implementation: %s)...", self.attn_impl)
+        config = AutoConfig.from_pretrained("replit/replit-code-v1-3b", use_auth_token=self.hf_token, trust_remote_code=True)  # type: ignore
+        config.attn_config["attn_impl"] = self.attn_impl
+        self.model = AutoModelForCausalLM.from_pretrained("replit/replit-code-v1-3b", config=config, use_auth_token=self.hf_token, trust_remote_code=True).to("cuda", dtype=torch.bfloat16)  # type: ignore pylint: disable=no-member
 
         self.model.eval()  # type: ignore
         self.logger.info("Booted")
@@ -44,7 +56,7 @@ class DreambotBackendReplit(DreambotWorkerBase):
 
     async def shutdown(self):
         """Shutdown our model."""
-        return
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
     async def callback_receive_workload(self, queue_name: str, message: dict[str, Any]) -> bool:
         """Receive work from NATS.
@@ -59,32 +71,12 @@ class DreambotBackendReplit(DreambotWorkerBase):
         self.logger.info("callback_receive_workload: %s", message)
 
         try:
-            argparser = self.arg_parser()
-            args = argparser.parse_args(message["prompt"].split(" "))
+            args = self.argparser.parse_args(message["prompt"].split(" "))
             args.prompt = " ".join(args.prompt)
 
-            # Tokenize our prompt and do inference
+            # Inference is slow and blocking, so keep it off the event loop
             self.logger.debug("Sending request to Replit...")
-            tokens = self.tokenizer.encode(args.prompt, return_tensors="pt", max_length=1024, truncation=True).to("cuda")  # type: ignore
-
-            set_seed(args.seed)
-
-            generation = self.model.generate(  # type: ignore
-                tokens,
-                max_new_tokens=args.max_new_tokens,
-                temperature=args.temperature,
-                pad_token_id=self.tokenizer.pad_token_id,  # type: ignore
-                eos_token_id=self.tokenizer.eos_token_id,  # type: ignore
-                top_p=0.95,  # FIXME: Make this an arg, see https://huggingface.co/spaces/replit/replit-code-v1-3b-demo/blob/main/app.py
-                top_k=4,  # FIXME: Ditto
-                use_cache=True,  # FIXME: Ditto
-                repetition_penalty=1.0,  # FIXME: Ditto
-            )
-
-            # Decoding our result
-            response = self.tokenizer.decode(  # type: ignore
-                generation[0], skip_special_tokens=True, clean_up_tokenization_spaces=False
-            )
+            response = await asyncio.get_running_loop().run_in_executor(self.executor, self.generate, args)
 
             # Fetch the response, prepare it to be sent back to the user and added to their cache
             message["reply-text"] = response
@@ -100,6 +92,41 @@ class DreambotBackendReplit(DreambotWorkerBase):
         await self.send_message(message)
         return True
 
+    def generate(self, args: Namespace) -> str:
+        """Generate a response from the model.
+
+        This blocks until inference is complete, so it should be run in our executor rather than on the event loop.
+
+        Args:
+            args (Namespace): The output of a previous call to parse_args().
+
+        Returns:
+            str: The decoded output of the model.
+        """
+        # Tokenize our prompt and do inference
+        tokens = self.tokenizer.encode(args.prompt, return_tensors="pt", max_length=1024, truncation=True).to("cuda")  # type: ignore
+
+        set_seed(args.seed)
+
+        # inference_mode() skips autograd's version counter and view tracking, which no_grad() still pays for
+        with torch.inference_mode():
+            generation = self.model.generate(  # type: ignore
+                tokens,
+                max_new_tokens=args.max_new_tokens,
+                temperature=args.temperature,
+                pad_token_id=self.tokenizer.pad_token_id,  # type: ignore
+                eos_token_id=self.tokenizer.eos_token_id,  # type: ignore
+                top_p=0.95,  # FIXME: Make this an arg, see https://huggingface.co/spaces/replit/replit-code-v1-3b-demo/blob/main/app.py
+                top_k=4,  # FIXME: Ditto
+                use_cache=True,  # FIXME: Ditto
+                repetition_penalty=1.0,  # FIXME: Ditto
+            )
+
+        # Decoding our result
+        return self.tokenizer.decode(  # type: ignore
+            generation[0], skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )
+
     def arg_parser(self) -> ErrorCatchingArgumentParser:
         """Create an argument parser for this backend.
 
@@ -11,7 +11,11 @@ class DreambotBackendGPTCLI(DreambotCLI):
   "gpt": {
       "api_key": "abc123",
       "organization": "dreambot",
-      "model": "davinci"
+      "model": "davinci",
+      "max_concurrency": 8,
+      "max_retries": 6,
+      "max_retry_time": 20.0,
+      "max_tokens": null
   },
   "nats_uri": [ "nats://nats-1:4222", "nats://nats-2:4222" ]
 }"""
@@ -1,4 +1,11 @@
 """Dreambot Replit backend launcher."""
+import os
+
+# This has to be set before torch is imported. Expandable segments let PyTorch's caching allocator grow its existing
+# blocks rather than fragmenting as prompts (and so KV caches) of different lengths come and go.
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
+# pylint: disable=wrong-import-position
 from dreambot.backend.replit import DreambotBackendReplit
 from dreambot.shared.cli import DreambotCLI
 
@@ -8,6 +15,8 @@ class DreambotBackendReplitCLI(DreambotCLI):
 
     example_json = """Example JSON config:
 {
+  "hugging_face_token": "hf_abc123",
+  "replit_attn_impl": "triton",
   "nats_uri": [ "nats://nats-1:4222", "nats://nats-2:4222" ]
 }"""
 
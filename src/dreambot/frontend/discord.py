@@ -1,12 +1,12 @@
 """Discord frontend for Dreambot."""
 import asyncio
-import base64
 import io
 import traceback
 
 from typing import Any
 
 import discord
+import pybase64
 
 from dreambot.shared.worker import DreambotWorkerBase, DreambotWorkerEndType, CallbackSendWorkload
 
@@ -94,7 +94,7 @@ class FrontendDiscord(DreambotWorkerBase):
             return True
 
         if "reply-image" in message:
-            image_bytes = base64.standard_b64decode(message["reply-image"])
+            image_bytes = pybase64.b64decode(message["reply-image"], validate=True)
             file_bytes = io.BytesIO(image_bytes)
             filename = self.clean_filename(message["prompt"], suffix=".png", output_dir=self.options["output_dir"])
             reply_args["file"] = discord.File(file_bytes, filename=filename)
@@ -136,48 +136,49 @@ class FrontendDiscord(DreambotWorkerBase):
         self.logger.debug("Received message: %s", message.content)
         text = message.content
 
-        for trigger in self.options["triggers"]:
-            if text.startswith(trigger + " "):
-                prompt = text[len(trigger) + 1 :]
-
-                reply = {
-                    "to": self.options["triggers"][trigger],
-                    "reply-to": self.address,
-                    "frontend": "discord",
-                    "channel": message.channel.id,
-                    "user": message.author.id,
-                    "user_name": message.author.name,
-                    "origin_message": message.id,
-                    "trigger": trigger,
-                    "prompt": prompt,
-                }
-
-                if hasattr(message.channel, "name"):
-                    reply["channel_name"] = str(message.channel.name) if message.channel.name else "DM"  # type: ignore
-                else:
-                    reply["channel_name"] = "DM"
-
-                if message.guild:
-                    reply["server_name"] = message.guild.name
-                    reply["server_id"] = message.guild.id
-                else:
-                    reply["server_name"] = "DM"
-
-                # If the message has an image, attach it to the packet
-                if len(message.embeds) > 0 and message.embeds[0].image:
-                    image = message.embeds[0].image
-                    if image:
-                        reply["image_url"] = image.url
-
-                self.logger.info("INPUT: %s %s", self.log_slug(reply), text)  # type: ignore
-
-                # Publish the trigger
-                try:
-                    await self.callback_send_workload(reply)
-                    await message.add_reaction("👍")
-                except Exception:
-                    traceback.print_exc()
-                    await message.add_reaction("👎")
+        match = self.match_trigger(text)
+        if not match:
+            return
+        trigger, prompt = match
+
+        reply = {
+            "to": self.options["triggers"][trigger],
+            "reply-to": self.address,
+            "frontend": "discord",
+            "channel": message.channel.id,
+            "user": message.author.id,
+            "user_name": message.author.name,
+            "origin_message": message.id,
+            "trigger": trigger,
+            "prompt": prompt,
+        }
+
+        if hasattr(message.channel, "name"):
+            reply["channel_name"] = str(message.channel.name) if message.channel.name else "DM"  # type: ignore
+        else:
+            reply["channel_name"] = "DM"
+
+        if message.guild:
+            reply["server_name"] = message.guild.name
+            reply["server_id"] = message.guild.id
+        else:
+            reply["server_name"] = "DM"
+
+        # If the message has an image, attach it to the packet
+        if len(message.embeds) > 0 and message.embeds[0].image:
+            image = message.embeds[0].image
+            if image:
+                reply["image_url"] = image.url
+
+        self.logger.info("INPUT: %s %s", self.log_slug(reply), text)  # type: ignore
+
+        # Publish the trigger
+        try:
+            await self.callback_send_workload(reply)
+            await message.add_reaction("👍")
+        except Exception:
+            traceback.print_exc()
+            await message.add_reaction("👎")
 
     def log_slug(self, resp: dict[str, str]) -> str:
         """Return a string to identify a message in logs."""
@@ -1,11 +1,13 @@
 """IRC frontend for Dreambot."""
 import asyncio
-import base64
 import logging
 import os
 import textwrap
 import traceback
 from typing import NamedTuple, Any, Self
+
+import pybase64
+
 from dreambot.shared.worker import DreambotWorkerBase, DreambotWorkerEndType, CallbackSendWorkload
 
 
@@ -31,44 +33,34 @@ class Message(NamedTuple):
         Args:
             line (str): A raw IRC line.
 
+        Raises:
+            ValueError: The line is not a valid IRC message.
+
         Returns:
             Message: The parsed line.
         """
         # parses an irc line based on RFC:
         # https://tools.ietf.org/html/rfc2812#section-2.3.1
+        # Each step is a single C-level partition() or split(), rather than a regex match
         prefix: Prefix | None = None
-
-        if line.startswith(":"):
-            # prefix
-            prefix_str, line = line.split(None, 1)
-            name = prefix_str[1:]
-            ident = ""
-            host = ""
-            if "!" in name:
-                name, ident = name.split("!", 1)
-                if "@" in ident:
-                    ident, host = ident.split("@", 1)
-            elif "@" in name:
-                name, host = name.split("@", 1)
-            prefix = Prefix(name, ident, host)
-
-        command, *line = line.split(None, 1)  # type: ignore
-        command = command.upper()
-
-        params: list[str] = []
-        if line:
-            line = line[0]
-            while line:
-                if line.startswith(":"):
-                    params.append(line[1:])
-                    line = ""
-                else:
-                    param, *line = line.split(None, 1)  # type: ignore
-                    params.append(param)
-                    if line:
-                        line = line[0]
-
-        return Message(prefix, command, params)
+        rest = line
+        if rest.startswith(":"):
+            prefix_str, _, rest = rest[1:].partition(" ")
+            rest = rest.lstrip(" ")
+            # A prefix is either a server name, or nick[!ident][@host]
+            name, _, host = prefix_str.partition("@")
+            nick, _, ident = name.partition("!")
+            prefix = Prefix(nick, ident, host)
+
+        middle, has_trailing, trailing = rest.partition(" :")
+        params: list[str] = middle.split()
+        if not params or params[0].startswith(":"):
+            raise ValueError(f"Unable to parse IRC line: {line}")
+        command = params.pop(0)
+        if has_trailing:
+            params.append(trailing)
+
+        return Message(prefix, command.upper(), params)
 
     def full_ident(self) -> str:
         """Return the full ident of the message."""
@@ -94,6 +86,15 @@ class Message(NamedTuple):
 class FrontendIRC(DreambotWorkerBase):
     """IRC frontend for Dreambot."""
 
+    # The IRC commands we act on, and the name of the method that handles each of them
+    command_handlers = {
+        "PING": "irc_received_ping",
+        "001": "irc_received_welcome",
+        "443": "irc_received_nickname_in_use",
+        "PRIVMSG": "irc_received_privmsg",
+        "JOIN": "irc_received_join",
+    }
+
     def __init__(
         self,
         irc_server: dict[str, Any],
@@ -112,8 +113,10 @@ class FrontendIRC(DreambotWorkerBase):
         self.server = irc_server
         self.full_ident = ""
         self.irc_timeout = 300
+        self.irc_max_line = 65536  # The same limit asyncio.StreamReader.readline() enforced
         self.writer: asyncio.StreamWriter | None = None
         self.reader: asyncio.StreamReader | None = None
+        self.publish_tasks: set[asyncio.Task[None]] = set()
 
     async def boot(self):
         """Boot the instance.
@@ -127,18 +130,39 @@ class FrontendIRC(DreambotWorkerBase):
                 self.reader, self.writer = await asyncio.open_connection(
                     self.server["host"], self.server["port"], ssl=self.server["ssl"]
                 )
-                await self.send_line(f"NICK {self.server['nickname']}")
-                await self.send_line(f"USER {self.server['ident']} * * :{self.server['realname']}")
+                await self.send_lines(
+                    [
+                        f"NICK {self.server['nickname']}",
+                        f"USER {self.server['ident']} * * :{self.server['realname']}",
+                    ]
+                )
                 self.logger.info("IRC connection booted.")
                 self.is_booted = True
 
-                # Loop until the connection is closed
+                # Loop until the connection is closed, with the per-line lookups bound to locals up front.
+                # We read whatever the server has sent in one go and split it into lines ourselves, rather than
+                # awaiting readline() for every single line.
+                reader = self.reader
+                handle_line = self.handle_line
+                irc_timeout = self.irc_timeout
+                buffer = bytearray()
                 while True:
                     self.logger.debug("Waiting for IRC data...")
-                    if self.reader.at_eof():  # There's nothing more waiting for us
+                    async with asyncio.timeout(irc_timeout):
+                        chunk = await reader.read(65536)
+                    if not chunk:  # There's nothing more waiting for us
+                        if buffer:
+                            await handle_line(bytes(buffer))
                         break
-                    data = await asyncio.wait_for(self.reader.readline(), timeout=self.irc_timeout)
-                    await self.handle_line(data)
+                    buffer += chunk
+                    start = 0
+                    while (end := buffer.find(b"\n", start)) >= 0:
+                        await handle_line(bytes(buffer[start:end]))
+                        start = end + 1
+                    del buffer[:start]
+                    if len(buffer) > self.irc_max_line:
+                        # Don't buffer forever for a server that never finishes its line
+                        raise ValueError(f"IRC line exceeds {self.irc_max_line} bytes without a newline")
             except ConnectionRefusedError:
                 self.logger.error("IRC connection refused")
             except (asyncio.TimeoutError, ConnectionResetError) as exc:
@@ -184,12 +208,12 @@ class FrontendIRC(DreambotWorkerBase):
         reply_kind = "OUTPUT"
 
         if "reply-image" in message:
-            image_bytes = base64.standard_b64decode(message["reply-image"])
-            filename = self.clean_filename(message["prompt"], suffix=".png", output_dir=self.options["output_dir"])
+            output_dir = self.options["output_dir"]
+            filename = self.clean_filename(message["prompt"], suffix=".png", output_dir=output_dir)
             url = f"{self.options['uri_base']}/{filename}"
 
-            with open(os.path.join(self.options["output_dir"], filename), "wb") as image_file:
-                image_file.write(image_bytes)
+            # Decoding and writing large images would otherwise stall every IRC connection in this process
+            await asyncio.to_thread(self.write_image, os.path.join(output_dir, filename), message["reply-image"])
             reply_message = f"{message['user']}: I dreamed this: {url}"
             self.log_reply(message, reply_message)
         elif "reply-text" in message:
@@ -215,10 +239,22 @@ class FrontendIRC(DreambotWorkerBase):
             # a message on the queue when it's done.
             return True
 
+        channel = message["channel"]
         for chunk in self.split_lines(message, reply_message):
-            await self.send_cmd("PRIVMSG", *[message["channel"], chunk])
+            await self.send_cmd("PRIVMSG", channel, chunk)
         return True
 
+    def write_image(self, path: str, image_data: str):
+        """Decode a base64 encoded image and write it to disk.
+
+        Args:
+            path (str): The path to write the image to.
+            image_data (str): The base64 encoded image data.
+        """
+        image_bytes = pybase64.b64decode(image_data, validate=True)
+        with open(path, "wb") as image_file:
+            image_file.write(image_bytes)
+
     async def send_line(self, line: str):
         """Send a line of text to the IRC server.
 
@@ -228,16 +264,35 @@ class FrontendIRC(DreambotWorkerBase):
         Args:
             line (str): The line to send.
 
+        Raises:
+            ValueError: No writer is available, we are likely offline.
+        """
+        await self.send_lines([line])
+
+    async def send_lines(self, lines: list[str]):
+        """Send several lines of text to the IRC server in a single write.
+
+        Each line is treated as it would be by send_line(), but they are coalesced into one buffer so a burst of commands costs one write and one drain.
+
+        Args:
+            lines (list[str]): The lines to send.
+
         Raises:
             ValueError: No writer is available, we are likely offline.
         """
         if not self.writer:
             raise ValueError("No writer available")
 
-        if len(line) > 510:
-            self.logger.warning("Line length exceeds RFC limit of 512 characters: %s", len(line))
-        self.logger.debug("-> %s", line)
-        self.writer.write(line.encode("utf-8") + b"\r\n")
+        chunks: list[bytes] = []
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        for line in lines:
+            data = f"{line}\r\n".encode("utf-8")
+            if len(data) > 512:
+                self.logger.warning("Line length exceeds RFC limit of 512 bytes: %s", len(data))
+            if debug:
+                self.logger.debug("-> %s", line)
+            chunks.append(data)
+        self.writer.write(b"".join(chunks))
         await self.writer.drain()
 
     async def send_cmd(self, cmd: str, *parts: str):
@@ -249,12 +304,10 @@ class FrontendIRC(DreambotWorkerBase):
             cmd (str): The IRC command to send. These commands are documented in the IRC RFC.
             *parts (str): The parameters to send with the command.
         """
-        params = list(parts)  # copy
-        if params:
-            if " " in params[-1]:
-                params[-1] = ":" + params[-1]
-        params = [cmd] + params
-        await self.send_line(" ".join(params))
+        if parts and " " in parts[-1]:
+            await self.send_line(" ".join((cmd, *parts[:-1], f":{parts[-1]}")))
+        else:
+            await self.send_line(" ".join((cmd, *parts)))
 
     async def handle_line(self, data: bytes):
         """Handle an incoming line of text from the IRC server.
@@ -268,39 +321,65 @@ class FrontendIRC(DreambotWorkerBase):
             line = data.decode("latin1")
 
         line = line.strip()
-        if line:
+        if line.startswith("PING "):
+            # Keepalives are the most common thing the server sends us, so answer them without parsing the line
+            await self.send_line("PONG" + line[4:])
+        elif line:
             message = Message.parse_line(line)
-            self.logger.debug("%s <- %s", self.server["host"], message)
-
-            if message.command == "PING":
-                await self.send_cmd("PONG", *message.params)
-            elif message.command == "001":
-                await self.irc_join(self.server["channels"])
-            elif message.command == "443":
-                await self.irc_renick()
-            elif message.command == "PRIVMSG":
-                await self.irc_received_privmsg(message)
-            elif message.command == "JOIN":
-                self.irc_received_join(message)
-            elif message.command.isdigit() and int(message.command) >= 400:
-                # might be an error
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("%s <- %s", self.server["host"], message)
+
+            handler = self.command_handlers.get(message.command)
+            if handler:
+                await getattr(self, handler)(message)
+            elif len(message.command) == 3 and message.command.isdigit() and message.command >= "400":
+                # might be an error (numerics are always three digits, so they compare correctly as strings)
                 self.logger.error("Possible server error: %s", str(message))
 
+    async def irc_received_ping(self, message: Message):
+        """Reply to a PING from the IRC server."""
+        await self.send_cmd("PONG", *message.params)
+
+    async def irc_received_welcome(self, message: Message):  # pylint: disable=unused-argument
+        """Join our channels once the IRC server has welcomed us."""
+        await self.irc_join(self.server["channels"])
+
+    async def irc_received_nickname_in_use(self, message: Message):  # pylint: disable=unused-argument
+        """Pick a new nickname because the IRC server says ours is in use."""
+        await self.irc_renick()
+
     async def irc_join(self, channels: list[str]):
-        """Join an IRC channel.
+        """Join IRC channels.
+
+        Channels are joined several at a time with comma separated JOIN commands, except for channels that need a key,
+        which are joined individually.
 
         Args:
-            channels (list[str]): A list of channels to join.
+            channels (list[str]): A list of channels to join, each optionally followed by a space and its key.
         """
+        max_length = 510 - len("JOIN ")  # send_lines() adds 2 bytes for the CRLF
+        lines: list[str] = []
+        joined = ""
         for channel in channels:
-            await self.send_cmd("JOIN", channel)
+            if " " in channel:
+                lines.append(f"JOIN {channel}")
+            elif not joined:
+                joined = channel
+            elif len(joined.encode()) + len(channel.encode()) + 1 > max_length:
+                lines.append(f"JOIN {joined}")
+                joined = channel
+            else:
+                joined = f"{joined},{channel}"
+        if joined:
+            lines.append(f"JOIN {joined}")
+        await self.send_lines(lines)
 
     async def irc_renick(self):
         """Change the bot's nickname because our desired nickname is already in use."""
         self.server["nickname"] = self.server["nickname"] + "_"
         await self.send_line(f"NICK {self.server['nickname']}")
 
-    def irc_received_join(self, message: Message):
+    async def irc_received_join(self, message: Message):
         """Handle a JOIN message from the IRC server. Used to build our full ident string."""
         self.full_ident = f":{message.full_ident()} "
 
@@ -316,27 +395,43 @@ class FrontendIRC(DreambotWorkerBase):
         target = message.target()
         text = message.params[1].lstrip()
 
-        for trigger in self.options["triggers"]:
-            if text.startswith(f"{trigger} "):
-                self.logger.info("INPUT: %s:%s <%s> %s", self.server["host"], target, source, text)
-                prompt = text[len(trigger) + 1 :]
-                reply = {
-                    "to": self.options["triggers"][trigger],
-                    "reply-to": self.address,
-                    "frontend": "irc",
-                    "server": self.server["host"],
-                    "channel": target,
-                    "user": source,
-                    "trigger": trigger,
-                    "prompt": prompt,
-                }
-
-                # Publish the trigger
-                try:
-                    await self.callback_send_workload(reply)
-                except Exception:
-                    traceback.print_exc()
-                    await self.send_cmd("PRIVMSG", *[target, f"{source}: Dream sequence failed."])
+        match = self.match_trigger(text)
+        if not match:
+            return
+
+        trigger, prompt = match
+        self.logger.info("INPUT: %s:%s <%s> %s", self.server["host"], target, source, text)
+        reply = {
+            "to": self.options["triggers"][trigger],
+            "reply-to": self.address,
+            "frontend": "irc",
+            "server": self.server["host"],
+            "channel": target,
+            "user": source,
+            "trigger": trigger,
+            "prompt": prompt,
+        }
+
+        # Publish the trigger in the background, so waiting for JetStream to acknowledge it doesn't stall reading from IRC
+        task = asyncio.create_task(self.publish_trigger(reply))
+        self.publish_tasks.add(task)
+        task.add_done_callback(self.publish_tasks.discard)
+
+    async def publish_trigger(self, reply: dict[str, Any]):
+        """Publish a triggered prompt to NATS, telling the user if that fails.
+
+        Args:
+            reply (dict[str, Any]): The workload message to publish.
+        """
+        try:
+            await self.callback_send_workload(reply)
+        except Exception:
+            traceback.print_exc()
+            try:
+                await self.send_cmd("PRIVMSG", reply["channel"], f"{reply['user']}: Dream sequence failed.")
+            except Exception as exc:
+                # This runs in a background task, so nothing else would ever see this exception
+                self.logger.error("Unable to tell %s that their trigger failed: %s", reply["user"], exc)
 
     def split_lines(self, message: dict[str, Any], reply_message: str) -> list[str]:
         """Split lines to safe IRC lengths.
@@ -349,11 +444,11 @@ class FrontendIRC(DreambotWorkerBase):
             list[str]: A list of strings that are IRC RFC compliant lengths (ie <510 characters)
         """
         chunks: list[str] = []
+        # IRC has a max line length of 512 bytes, so we need to split each line into chunks
+        max_chunk_size = 510  # Start with 510 because send_cmd() adds 2 bytes for the CRLF
+        max_chunk_size -= len(f"{self.full_ident} PRIVMSG {message['channel']} :")
         # We have to send multiline responses separately, so let's split the message into lines
         for line in reply_message.splitlines():
-            # IRC has a max line length of 512 bytes, so we need to split the line into chunks
-            max_chunk_size = 510  # Start with 510 because send_cmd() adds 2 bytes for the CRLF
-            max_chunk_size -= len(f"{self.full_ident} PRIVMSG {message['channel']} :")
             chunks += textwrap.wrap(line, max_chunk_size)
         return chunks
 
@@ -98,38 +98,38 @@ class FrontendSlack(DreambotWorkerBase):
             return
 
         text = msg["event"]["text"]
-        for trigger in self.options["triggers"]:
-            self.logger.debug("Checking trigger: '%s'", trigger + " ")
-            if text.startswith(trigger + " "):
-                prompt = text[len(trigger) + 1 :]
-
-                reply = {
-                    "to": self.options["triggers"][trigger],
-                    "reply-to": self.address,
-                    "frontend": "slack",
-                    "channel": msg["event"]["channel"],
-                    "user": msg["event"]["user"],
-                    "trigger": trigger,
-                    "prompt": prompt,
-                }
-
-                if reply["user"] not in self.user_name_cache:
-                    user_info = await self.slack.client.users_info(user=reply["user"])  # type: ignore
-                    self.logger.error("********* FOUND USER INFO: %s", user_info)
-                    self.user_name_cache[reply["user"]] = user_info["user"]["real_name"]
-                reply["user_name"] = self.user_name_cache[reply["user"]]
-
-                # FIXME: Get channel_name and server_name here
-
-                self.logger.info("INPUT: %s %s", self.log_slug(reply), text)
-
-                # Publish the trigger
-                try:
-                    await self.callback_send_workload(reply)
-                    # FIXME: Add thumbs-up reaction
-                except Exception:
-                    traceback.print_exc()
-                    # FIXME: Add thumbs-down reaction
+        match = self.match_trigger(text)
+        if not match:
+            return
+        trigger, prompt = match
+
+        reply = {
+            "to": self.options["triggers"][trigger],
+            "reply-to": self.address,
+            "frontend": "slack",
+            "channel": msg["event"]["channel"],
+            "user": msg["event"]["user"],
+            "trigger": trigger,
+            "prompt": prompt,
+        }
+
+        if reply["user"] not in self.user_name_cache:
+            user_info = await self.slack.client.users_info(user=reply["user"])  # type: ignore
+            self.logger.error("********* FOUND USER INFO: %s", user_info)
+            self.user_name_cache[reply["user"]] = user_info["user"]["real_name"]
+        reply["user_name"] = self.user_name_cache[reply["user"]]
+
+        # FIXME: Get channel_name and server_name here
+
+        self.logger.info("INPUT: %s %s", self.log_slug(reply), text)
+
+        # Publish the trigger
+        try:
+            await self.callback_send_workload(reply)
+            # FIXME: Add thumbs-up reaction
+        except Exception:
+            traceback.print_exc()
+            # FIXME: Add thumbs-down reaction
 
     def log_slug(self, resp: dict[str, str]) -> str:
         """Return a string to identify a message in logs."""
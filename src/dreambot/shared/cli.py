@@ -12,6 +12,11 @@ from argparse import ArgumentParser, RawTextHelpFormatter, Namespace
 from dreambot.shared.nats import NatsManager
 from dreambot.shared.worker import DreambotWorkerBase
 
+try:
+    import uvloop
+except ImportError:  # uvloop doesn't support Windows
+    uvloop = None  # pylint: disable=invalid-name
+
 
 class DreambotCLI:
     """This class should be used for building a Dreambot worker command."""
@@ -83,6 +88,9 @@ class DreambotCLI:
         """Establish the event loop and run the associated tasks."""
         loop: asyncio.AbstractEventLoop | None = None
         try:
+            # uvloop's event loop is considerably faster than asyncio's default, particularly for socket I/O
+            if uvloop:
+                asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
             loop = asyncio.get_event_loop()
 
             # FIXME: This is ungraceful, but Windows can't do signal handling this way.
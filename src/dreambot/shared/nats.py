@@ -1,7 +1,6 @@
 """NATS manager for Dreambot."""
 
 import asyncio
-import json
 import logging
 import sys
 import traceback
@@ -12,9 +11,11 @@ from typing import Any
 from nats.js.errors import BadRequestError, NotFoundError
 from nats.js import JetStreamContext, JetStreamManager
 from nats.aio.client import Client as NATSClient
+from nats.aio.msg import Msg
 
 import nats
 import nats.errors
+import orjson
 
 from dreambot.shared.worker import DreambotWorkerBase, DreambotWorkerEndType
 
@@ -35,6 +36,8 @@ class NatsManager:
         self.shutting_down = False
         self.logger = logging.getLogger(f"dreambot.shared.nats.{self.name}")
         self.stream_name = "dreambot"
+        # How often we tell JetStream a slow message is still being worked on, well inside its 30s ack window
+        self.in_progress_interval = 10.0
 
         self.nats: NATSClient | None = None
         self.jets: JetStreamContext
@@ -48,7 +51,7 @@ class NatsManager:
         _ = [task.cancel() for task in self.nats_tasks]
         self.nats_tasks = []
 
-        # We do this so the asyncio.gather() in boot() has time to notice its tasks
+        # We do this so the TaskGroup in boot() has time to notice its tasks
         # have all finished before we kill all other tasks
         await asyncio.sleep(5)
 
@@ -75,14 +78,14 @@ class NatsManager:
             self.jets = self.nats.jetstream()  # type: ignore
             self.jsm = self.nats.jsm()  # type: ignore
 
-            for worker in workers:
-                # Each worker needs to know its own NATS 'address' (ie subject)
-                worker.address = self.get_subject(worker)
+            # If one subscriber fails unexpectedly, the TaskGroup cancels the others rather than leaving them orphaned
+            async with asyncio.TaskGroup() as task_group:
+                for worker in workers:
+                    # Each worker needs to know its own NATS 'address' (ie subject)
+                    worker.address = self.get_subject(worker)
 
-                # Set up NATS subscriptions for each worker
-                self.nats_tasks.append(asyncio.create_task(self.subscribe(worker)))
-
-            await asyncio.gather(*self.nats_tasks)
+                    # Set up NATS subscriptions for each worker
+                    self.nats_tasks.append(task_group.create_task(self.subscribe(worker)))
         except nats.errors.NoServersError:
             self.logger.error("NATS failed to connect to any servers")
         except Exception as exc:
@@ -123,33 +126,38 @@ class NatsManager:
                     subject, stream=self.stream_name, durable=queue_name, manual_ack=True, queue=queue_name
                 )
 
+                # Messages are processed concurrently, up to the worker's limit
+                in_flight: set[Task[None]] = set()
                 while not self.shutting_down:
+                    if len(in_flight) >= worker.max_concurrency:
+                        await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                        continue
+
                     self.logger.debug("Waiting for NATS message on %s", subject)
                     try:
                         msg = await sub.next_msg()
-                        msg_str = msg.data.decode()
-                        msg_dict: dict[str, Any] = json.loads(msg_str)
-
-                        log_dict = msg_dict.copy()
-                        if "reply-image" in log_dict:
-                            log_dict["reply-image"] = "** IMAGE **"
-                        self.logger.debug("Received NATS message on '%s': %s", subject, log_dict)
-
-                        worker_callback_result = None
                         try:
-                            if not worker.is_booted:
-                                self.logger.debug("Worker not fully booted yet, skipping message")
-                                await asyncio.sleep(1)
-                                continue
-
-                            # We will remove the message from the queue if the callback returns anything but False
-                            worker_callback_result = await worker.callback_receive_workload(subject, msg_dict)
-                            if worker_callback_result is not False:
-                                await msg.ack()
-                        except Exception as exc:
-                            self.logger.error("callback_receive_workload exception: %s", exc)
-                            traceback.print_exc()
-                            await msg.ack()
+                            msg_dict = self.decode_message(msg.data)
+                        except orjson.JSONDecodeError as exc:
+                            # This message will never decode, so stop NATS from redelivering it
+                            self.logger.error("Discarding undecodable NATS message on '%s': %s", subject, exc)
+                            await msg.term()
+                            continue
+
+                        if self.logger.isEnabledFor(logging.DEBUG):
+                            log_dict = msg_dict.copy()
+                            if "reply-image" in log_dict:
+                                log_dict["reply-image"] = "** IMAGE **"
+                            self.logger.debug("Received NATS message on '%s': %s", subject, log_dict)
+
+                        if not worker.is_booted:
+                            self.logger.debug("Worker not fully booted yet, skipping message")
+                            await asyncio.sleep(1)
+                            continue
+
+                        task = asyncio.create_task(self.process_message(worker, subject, msg, msg_dict))
+                        in_flight.add(task)
+                        task.add_done_callback(in_flight.discard)
                     except nats.errors.TimeoutError:
                         await asyncio.sleep(1)
                         continue
@@ -169,6 +177,58 @@ class NatsManager:
                 traceback.print_exc()
                 await asyncio.sleep(5)
 
+    def decode_message(self, data: bytes) -> dict[str, Any]:
+        """Decode the JSON payload of a NATS message.
+
+        This is done inline even for large image replies, since orjson holds the GIL for the whole parse, so handing it
+        to a thread would only add overhead without freeing the event loop.
+
+        Args:
+            data (bytes): The raw message payload.
+
+        Returns:
+            dict[str, Any]: The decoded message.
+        """
+        return orjson.loads(data)
+
+    async def process_message(self, worker: DreambotWorkerBase, subject: str, msg: Msg, msg_dict: dict[str, Any]) -> None:
+        """Pass a NATS message to a worker, and acknowledge it if appropriate.
+
+        Args:
+            worker (DreambotWorkerBase): The Dreambot worker that should process the message.
+            subject (str): The subject the message was received on.
+            msg (Msg): The raw NATS message.
+            msg_dict (dict[str, Any]): The decoded message.
+        """
+        # Workers can take longer than JetStream's ack window (e.g. backing off from rate limits, or waiting for an
+        # earlier prompt from the same user), so keep telling it we're working on this message until we're done
+        heartbeat = asyncio.create_task(self.keep_in_progress(msg))
+        try:
+            # We will remove the message from the queue if the callback returns anything but False
+            worker_callback_result = await worker.callback_receive_workload(subject, msg_dict)
+            if worker_callback_result is not False:
+                await msg.ack()
+        except Exception as exc:
+            self.logger.error("callback_receive_workload exception: %s", exc)
+            traceback.print_exc()
+            await msg.ack()
+        finally:
+            heartbeat.cancel()
+
+    async def keep_in_progress(self, msg: Msg) -> None:
+        """Periodically tell JetStream that a message is still being processed, so it isn't redelivered.
+
+        Args:
+            msg (Msg): The raw NATS message.
+        """
+        while True:
+            await asyncio.sleep(self.in_progress_interval)
+            try:
+                await msg.in_progress()
+            except Exception as exc:
+                self.logger.warning("Unable to extend the NATS ack deadline: %s", exc)
+                return
+
     async def publish(self, message: dict[str, Any]):
         """Publish a message to NATS.
 
@@ -176,12 +236,13 @@ class NatsManager:
             subject (str): The NATS queue to publish to.
             data (bytes): The message to publish, as a bytes encoded JSON string.
         """
-        json_msg = message.copy()
-        if "reply-image" in json_msg:
-            json_msg["reply-image"] = "** IMAGE **"
-        self.logger.debug("Publishing to NATS: %s", json_msg)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            json_msg = message.copy()
+            if "reply-image" in json_msg:
+                json_msg["reply-image"] = "** IMAGE **"
+            self.logger.debug("Publishing to NATS: %s", json_msg)
 
-        data = json.dumps(message).encode()
+        data = orjson.dumps(message)
         await self.jets.publish(message["to"], data)  # type: ignore
 
     def get_queue_name(self, worker: DreambotWorkerBase) -> str:
@@ -1,17 +1,48 @@
 """Base class for Dreambot workers."""
 
+import functools
+import io
 import logging
 import os
+import re
 import string
 import unicodedata
 from enum import Enum
 from typing import Callable, Coroutine, Any
 
+from PIL import Image
 from dreambot.shared.custom_argparse import ErrorCatchingArgumentParser
 
 CallbackSendWorkload = Callable[[dict[str, Any]], Coroutine[Any, Any, None]]
 
 
+@functools.lru_cache(maxsize=1024)
+def sanitise_filename(filename: str, replace: str, invalid_bytes: bytes) -> str:
+    """Reduce a string to characters that are safe to use in a filename.
+
+    Users often repeat the same prompt, so results are cached.
+
+    Args:
+        filename (str): The string to sanitise.
+        replace (str): Characters that should be replaced with underscores.
+        invalid_bytes (bytes): ASCII bytes that should be removed.
+
+    Returns:
+        str: The sanitised string, without any length limit or suffix applied.
+    """
+    # replace undesired characters
+    filename = filename.translate(str.maketrans(replace, "_" * len(replace)))
+
+    # keep only valid ascii chars, and of those, only whitelisted chars
+    return (
+        unicodedata.normalize("NFKD", filename)
+        .encode("ASCII", "ignore")
+        .translate(None, invalid_bytes)
+        .decode("ascii")
+        .replace("__", "")
+    )
+
+
 class DreambotWorkerEndType(Enum):
     """Enum for identifying frontend/backend workers."""
 
@@ -52,6 +83,14 @@ class DreambotWorkerBase:
         self.logger = logging.getLogger(f"dreambot.{self.end.value}.{self.name}")
         self.should_reconnect = False
         self.address = ""  # This will be given to us later by NatsManager
+        self.max_concurrency = 1  # How many NATS messages NatsManager may have this worker process at once
+        self.filename_max_lengths: dict[str, int] = {}  # Cache of f_namemax for each output_dir we've seen
+        # Every byte that isn't in valid_filename_chars, for deletion with bytes.translate()
+        self.invalid_filename_bytes = bytes(c for c in range(256) if chr(c) not in self.valid_filename_chars)
+        # Triggers are static config, so the matcher for them is built once, here
+        self.trigger_re = self.trigger_regex()
+        # No trigger contains a space, so the first word of a message is enough
+        self.triggers_are_words = not any(" " in trigger for trigger in options.get("triggers", {}))
 
     async def send_message(self, resp: dict[str, Any]):
         """Send a message to NATS.
@@ -72,7 +111,7 @@ class DreambotWorkerBase:
             )
             await self.callback_send_workload(resp)
         except Exception as exc:
-            self.logger.error("Failed to send response: %s", format(exc))
+            self.logger.error("Failed to send response: %s", exc)
 
     async def boot(self) -> None:
         """Child classes must override this to perform tasks that need to happen between class initialisation and the worker starting.
@@ -96,20 +135,75 @@ class DreambotWorkerBase:
         """
         return ErrorCatchingArgumentParser(prog=self.name, exit_on_error=False)
 
+    def match_trigger(self, text: str) -> tuple[str, str] | None:
+        """Check whether a chat message starts with one of our triggers.
+
+        This can be used by frontend workers to decide whether an incoming message should be dispatched to a backend.
+
+        Args:
+            text (str): The text of the message.
+
+        Returns:
+            tuple[str, str] | None: The trigger that matched and the prompt that follows it, or None if no trigger matched.
+        """
+        if self.triggers_are_words:
+            # The usual case, where a single dict lookup on the first word replaces the regex
+            trigger, has_prompt, prompt = text.partition(" ")
+            if has_prompt and trigger in self.options["triggers"]:
+                return (trigger, prompt)
+            return None
+
+        match = self.trigger_re.match(text)
+        if not match:
+            return None
+        return (match.group(1), text[match.end() :])
+
+    def trigger_regex(self) -> re.Pattern[str]:
+        """Compile a regex that matches any of our triggers at the start of a line.
+
+        Most chat messages don't contain a trigger, so this lets us reject them with one match instead of a startswith() per trigger.
+
+        Returns:
+            re.Pattern[str]: A regex whose first group is the trigger that matched.
+        """
+        triggers = self.options.get("triggers", {})
+        # Longest first, so a trigger that is a prefix of another can't shadow it
+        alternation = "|".join(re.escape(trigger) for trigger in sorted(triggers, key=len, reverse=True))
+        # (?!) never matches, so an empty trigger list matches nothing
+        return re.compile(f"({alternation or '(?!)'}) ")
+
+    def resize_image(self, image: bytes) -> bytes:
+        """Resize an image so it's not too big for our VRAM.
+
+        This can be used by backend workers that accept an initial image from a URL. It is CPU heavy for large images, so
+        call it with asyncio.to_thread() rather than directly from the event loop.
+
+        Args:
+            image (bytes): The image data, in any format Pillow can read.
+
+        Returns:
+            bytes: The resized image, encoded as a JPEG.
+        """
+        resp_image = io.BytesIO()
+        thumbnail = Image.open(io.BytesIO(image))
+        # For JPEGs, let libjpeg scale down while decoding rather than decoding every pixel of a large photo.
+        # This is what thumbnail() would do itself, but only if convert() hasn't already loaded the full image.
+        thumbnail.draft("RGB", (1024, 1024))
+        if thumbnail.mode != "RGB":
+            # Some images have weird colour modes, so convert them to RGB
+            thumbnail = thumbnail.convert("RGB")
+        thumbnail.thumbnail((512, 512), Image.Resampling.LANCZOS)
+        thumbnail.save(resp_image, "JPEG")
+
+        return resp_image.getvalue()
+
     def clean_filename(self, filename: str, replace: str = " ", suffix: str = ".png", output_dir: str = ""):
         """Clean a filename to ensure it is valid for the host OS filesystem.
 
         This can be used by workers that want to use incoming prompts as the basis of filenames.
         """
-        char_limit = os.statvfs(output_dir).f_namemax - len(suffix)
-        whitelist = self.valid_filename_chars
-        # replace undesired characters
-        for char in replace:
-            filename = filename.replace(char, "_")
-
-        # keep only valid ascii chars
-        cleaned_filename = unicodedata.normalize("NFKD", filename).encode("ASCII", "ignore").decode()
-
-        # keep only whitelisted chars
-        cleaned_filename = "".join(c for c in cleaned_filename if c in whitelist).replace("__", "")
+        if output_dir not in self.filename_max_lengths:
+            self.filename_max_lengths[output_dir] = os.statvfs(output_dir).f_namemax
+        char_limit = self.filename_max_lengths[output_dir] - len(suffix)
+        cleaned_filename = sanitise_filename(filename, replace, self.invalid_filename_bytes)
         return cleaned_filename[:char_limit] + suffix
@@ -43,11 +43,14 @@ def test_boot():
 def test_run(mocker):
     loop = MagicMock()
     mock_get_event_loop = mocker.patch("asyncio.get_event_loop", MagicMock(return_value=loop))
+    mock_set_policy = mocker.patch("asyncio.set_event_loop_policy")
+    mocker.patch("dreambot.shared.cli.uvloop")
     cli = dreambot.shared.cli.DreambotCLI("test_run")
     cli.nats = AsyncMock()
     cli.workers = [AsyncMock(), AsyncMock()]
     cli.run()
 
+    assert mock_set_policy.call_count == 1
     assert mock_get_event_loop.call_count == 1
     assert loop.add_signal_handler.call_count == 4
     assert loop.create_task.call_count == 3
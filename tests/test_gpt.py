@@ -0,0 +1,128 @@
+# pylint: skip-file
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+import dreambot.backend.gpt
+from openai.error import RateLimitError
+
+
+@pytest.mark.asyncio
+async def test_concurrent_followups_for_one_user():
+    gpt = dreambot.backend.gpt.DreambotBackendGPT(
+        {"gpt": {"api_key": "abc", "organization": "def", "model": "gpt-4"}}, AsyncMock()
+    )
+    sent: list[list[dict[str, str]]] = []
+
+    async def chat_completion(**kwargs):
+        sent.append(list(kwargs["messages"]))
+        # Yield, so the second prompt gets a chance to run while the first is waiting for OpenAI
+        await asyncio.sleep(0)
+        answer = f"answer to {kwargs['messages'][-1]['content']}"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=answer))])
+
+    gpt.chat_completion = chat_completion
+
+    def message(prompt):
+        return {
+            "to": "backend.gpt",
+            "reply-to": "irc",
+            "channel": "#test",
+            "user": "testuser",
+            "trigger": "!gpt",
+            "prompt": prompt,
+        }
+
+    await asyncio.gather(
+        gpt.callback_receive_workload("gpt", message("first")),
+        gpt.callback_receive_workload("gpt", message("-f second")),
+    )
+
+    system = dreambot.backend.gpt.SYSTEM_MESSAGE
+    assert sent == [
+        [system, {"role": "user", "content": "first"}],
+        [
+            system,
+            {"role": "user", "content": "first"},
+            {"role": "assistant", "content": "answer to first"},
+            {"role": "user", "content": "second"},
+        ],
+    ]
+    assert gpt.conversation_cache["irc_#test_testuser"][-1] == {"role": "assistant", "content": "answer to second"}
+
+
+def test_reset_cache_copies_system_message():
+    gpt = dreambot.backend.gpt.DreambotBackendGPT(
+        {"gpt": {"api_key": "abc", "organization": "def", "model": "gpt-4"}}, AsyncMock()
+    )
+    gpt.reset_cache("one")
+    gpt.reset_cache("two")
+
+    gpt.conversation_cache["one"][0]["content"] = "changed"
+    assert gpt.conversation_cache["two"][0] == dreambot.backend.gpt.SYSTEM_MESSAGE
+    assert dreambot.backend.gpt.SYSTEM_MESSAGE["content"] != "changed"
+
+
+def test_retry_delay():
+    gpt = dreambot.backend.gpt.DreambotBackendGPT(
+        {"gpt": {"api_key": "abc", "organization": "def", "model": "gpt-4", "max_retry_time": 20.0}}, AsyncMock()
+    )
+
+    # OpenAI's retry-after is honoured, but never beyond our retry budget
+    assert gpt.retry_delay(RateLimitError("slow down", headers={"retry-after": "3"}), 1) == 3.0
+    assert gpt.retry_delay(RateLimitError("slow down", headers={"retry-after": "600"}), 1) == 20.0
+
+    # Otherwise we back off exponentially, with up to a second of jitter
+    assert 2.0 <= gpt.retry_delay(RateLimitError("slow down"), 1) <= 3.0
+    assert 8.0 <= gpt.retry_delay(RateLimitError("slow down", headers={"retry-after": "soon"}), 3) <= 9.0
+    assert gpt.retry_delay(RateLimitError("slow down"), 10) == 20.0
+
+
+@pytest.mark.asyncio
+async def test_chat_completion_retries(mocker):
+    gpt = dreambot.backend.gpt.DreambotBackendGPT(
+        {"gpt": {"api_key": "abc", "organization": "def", "model": "gpt-4"}}, AsyncMock()
+    )
+    sleep = mocker.patch("asyncio.sleep")
+    acreate = mocker.patch(
+        "openai.ChatCompletion.acreate",
+        side_effect=[RateLimitError("slow down", headers={"retry-after": "1"}), "response"],
+    )
+
+    assert await gpt.chat_completion(model="gpt-4") == "response"
+    assert acreate.call_count == 2
+    sleep.assert_called_once_with(1.0)
+
+
+@pytest.mark.asyncio
+async def test_chat_completion_gives_up_after_max_retries(mocker):
+    gpt = dreambot.backend.gpt.DreambotBackendGPT(
+        {"gpt": {"api_key": "abc", "organization": "def", "model": "gpt-4", "max_retries": 3}}, AsyncMock()
+    )
+    sleep = mocker.patch("asyncio.sleep")
+    acreate = mocker.patch("openai.ChatCompletion.acreate", side_effect=RateLimitError("slow down"))
+
+    with pytest.raises(RateLimitError):
+        await gpt.chat_completion(model="gpt-4")
+    assert acreate.call_count == 3
+    assert sleep.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_chat_completion_gives_up_after_max_retry_time(mocker):
+    gpt = dreambot.backend.gpt.DreambotBackendGPT(
+        {"gpt": {"api_key": "abc", "organization": "def", "model": "gpt-4", "max_retry_time": 5.0}}, AsyncMock()
+    )
+    sleep = mocker.patch("asyncio.sleep")
+    # Pretend each attempt takes 3 seconds of wall clock time
+    mocker.patch("dreambot.backend.gpt.time").monotonic.side_effect = [0.0, 3.0, 6.0]
+    acreate = mocker.patch(
+        "openai.ChatCompletion.acreate", side_effect=RateLimitError("slow down", headers={"retry-after": "30"})
+    )
+
+    with pytest.raises(RateLimitError):
+        await gpt.chat_completion(model="gpt-4")
+    assert acreate.call_count == 2
+    # The wait after the first attempt is clamped to what's left of the budget
+    sleep.assert_called_once_with(2.0)
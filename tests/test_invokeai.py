@@ -0,0 +1,26 @@
+# pylint: skip-file
+import orjson
+import pytest
+import dreambot.backend.invokeai
+
+
+@pytest.mark.asyncio
+async def test_graph_serialises(mocker):
+    mocker.patch("socketio.Client")
+    backend = dreambot.backend.invokeai.DreambotBackendInvokeAI({"invokeai": {"host": "abc123", "port": "1234"}}, None)
+    await backend.boot()
+
+    args = backend.argparser.parse_args(["a", "cat"])
+    args.prompt = " ".join(args.prompt)
+    graph = await backend.build_image_graph(args)
+
+    # The session's serialiser is what aiohttp uses for session.post(..., json=graph)
+    data = orjson.loads(backend.http_session._json_serialize(graph))
+    assert list(data["nodes"].keys()) == ["0", "1"]
+    assert data["nodes"]["0"]["type"] == "txt2img"
+    assert data["nodes"]["0"]["prompt"] == "a cat"
+    assert data["edges"] == [
+        {"source": {"node_id": "0", "field": "image"}, "destination": {"node_id": "1", "field": "image"}}
+    ]
+
+    await backend.shutdown()
@@ -142,10 +142,22 @@ def test_parse_line():
 
 
 @pytest.mark.asyncio
-async def test_irc_join(mock_send_cmd):
+async def test_irc_join(mocker):
+    mocker.patch("dreambot.frontend.irc.FrontendIRC.send_lines")
     irc = dreambot.frontend.irc.FrontendIRC({"host": "abc123"}, {"output_dir": "/tmp"}, None)
     await irc.irc_join(["#channel1", "#channel2"])
-    irc.send_cmd.assert_has_calls([call("JOIN", "#channel1"), call("JOIN", "#channel2")])
+    irc.send_lines.assert_called_once_with(["JOIN #channel1,#channel2"])
+
+
+@pytest.mark.asyncio
+async def test_irc_join_keys_and_long_lists(mocker):
+    mocker.patch("dreambot.frontend.irc.FrontendIRC.send_lines")
+    irc = dreambot.frontend.irc.FrontendIRC({"host": "abc123"}, {"output_dir": "/tmp"}, None)
+    channels = [f"#{i:0>99}" for i in range(6)]
+    await irc.irc_join(channels + ["#secret hunter2"])
+    irc.send_lines.assert_called_once_with(
+        [f"JOIN {','.join(channels[:5])}", "JOIN #secret hunter2", f"JOIN {channels[5]}"]
+    )
 
 
 @pytest.mark.asyncio
@@ -185,9 +197,23 @@ async def test_irc_privmsg(mock_send_cmd):
     irc.options["triggers"]["!test"] = "testend.test2"
     message = dreambot.frontend.irc.Message.parse_line(":OtherUser^!other@2.3.4.5 PRIVMSG #place :!test something")
     await irc.irc_received_privmsg(message)
+    await asyncio.gather(*irc.publish_tasks)
     assert cb_publish_called == True
 
 
+def test_trigger_regex():
+    irc = dreambot.frontend.irc.FrontendIRC(
+        {"host": "abc123"}, {"output_dir": "/tmp", "triggers": {"!a": "a", "!ab": "ab"}}, None
+    )
+    regex = irc.trigger_re
+    assert regex.match("!ab prompt").group(1) == "!ab"
+    assert regex.match("!a prompt").group(1) == "!a"
+    assert regex.match("!abc prompt") is None
+
+    irc = dreambot.frontend.irc.FrontendIRC({"host": "abc123"}, {"output_dir": "/tmp", "triggers": {}}, None)
+    assert irc.trigger_re.match("!a prompt") is None
+
+
 @pytest.mark.asyncio
 async def test_long_irc_line(mocker):
     mock_open_connection = mocker.patch("asyncio.open_connection", return_value=(AsyncMock(), AsyncMock()))
@@ -355,21 +381,38 @@ async def test_handle_response_silence(mock_send_cmd):
 
 
 @pytest.mark.asyncio
-async def test_handle_line_ping(mock_send_cmd):
+async def test_handle_line_ping(mock_send_cmd, mock_send_line):
+    irc = dreambot.frontend.irc.FrontendIRC(
+        {"host": "abc123", "nickname": "abc"},
+        {"output_dir": "/tmp", "triggers": [], "uri_base": "http://testuri/"},
+        None,
+    )
+
+    await irc.handle_line(b"PING :abc123\r\n")
+
+    assert irc.send_cmd.call_count == 0
+    assert irc.send_line.call_count == 1
+    irc.send_line.assert_has_calls([call("PONG :abc123")])
+
+
+@pytest.mark.asyncio
+async def test_handle_line_ping_with_prefix(mock_send_cmd, mock_send_line):
     irc = dreambot.frontend.irc.FrontendIRC(
         {"host": "abc123", "nickname": "abc"},
         {"output_dir": "/tmp", "triggers": [], "uri_base": "http://testuri/"},
         None,
     )
 
-    await irc.handle_line(b"PING :abc123")
+    await irc.handle_line(b":irc.server PING :abc123")
 
+    assert irc.send_line.call_count == 0
     assert irc.send_cmd.call_count == 1
     irc.send_cmd.assert_has_calls([call("PONG", "abc123")])
 
 
 @pytest.mark.asyncio
-async def test_handle_line_001(mock_send_cmd):
+async def test_handle_line_001(mocker):
+    mocker.patch("dreambot.frontend.irc.FrontendIRC.irc_join")
     irc = dreambot.frontend.irc.FrontendIRC(
         {"host": "abc123", "nickname": "abc", "channels": ["#test1", "#test2"]},
         {"output_dir": "/tmp", "triggers": [], "uri_base": "http://testuri/"},
@@ -378,8 +421,7 @@ async def test_handle_line_001(mock_send_cmd):
 
     await irc.handle_line(b"001")
 
-    assert irc.send_cmd.call_count == 2
-    irc.send_cmd.assert_has_calls([call("JOIN", "#test1"), call("JOIN", "#test2")])
+    irc.irc_join.assert_called_once_with(["#test1", "#test2"])
 
 
 @pytest.mark.asyncio
@@ -423,6 +465,7 @@ async def test_handle_line_privmsg_publish_raises(mock_send_cmd):
     )
     irc.callback_send_workload = AsyncMock(side_effect=Exception("test exception"))
     await irc.handle_line(b":testuser!testident@testhost PRIVMSG #testchannel :!test some text")
+    await asyncio.gather(*irc.publish_tasks)
 
     assert irc.callback_send_workload.call_count == 1
     irc.callback_send_workload.assert_has_calls(
@@ -443,6 +486,24 @@ async def test_handle_line_privmsg_publish_raises(mock_send_cmd):
     )
 
 
+@pytest.mark.asyncio
+async def test_handle_line_privmsg_publish_raises_while_offline(mocker):
+    irc = dreambot.frontend.irc.FrontendIRC(
+        {"host": "abc123", "nickname": "abc", "channels": ["#test1", "#test2"]},
+        {"output_dir": "/tmp", "triggers": {"!test": "testend.test"}, "uri_base": "http://testuri/"},
+        None,
+    )
+    irc.callback_send_workload = AsyncMock(side_effect=Exception("test exception"))
+    mocker.patch.object(irc.logger, "error")
+    assert irc.writer is None
+
+    await irc.handle_line(b":testuser!testident@testhost PRIVMSG #testchannel :!test some text")
+    results = await asyncio.gather(*irc.publish_tasks, return_exceptions=True)
+
+    assert results == [None]
+    irc.logger.error.assert_called_once_with("Unable to tell %s that their trigger failed: %s", "testuser", mocker.ANY)
+
+
 @pytest.mark.asyncio
 async def test_handle_line_unknown(mock_irc_privmsg, mock_send_cmd, mock_send_line):
     irc = dreambot.frontend.irc.FrontendIRC(
@@ -578,19 +639,82 @@ async def test_boot_single_loop_handshake(mocker, mock_send_cmd, mock_send_line,
 
     writer = AsyncMock()
     mock_asyncio_open_connection = mocker.patch("asyncio.open_connection", return_value=(reader, writer))
-    irc.send_line = mock_send_line
+    mock_send_lines = mocker.patch("dreambot.frontend.irc.FrontendIRC.send_lines")
 
     irc.should_reconnect = False
     await irc.boot()
 
     mock_asyncio_open_connection.assert_called_once()
     mock_sleep.assert_not_called()
-    assert mock_send_line.call_count == 2
-    mock_send_line.assert_has_calls([call("NICK abc"), call("USER testident * * :testrealname")])
+    mock_send_lines.assert_called_once_with(["NICK abc", "USER testident * * :testrealname"])
+    mock_send_line.assert_not_called()
     mock_send_cmd.assert_not_called()
     mock_handle_line.assert_has_calls([call(b"Testing input line, does not need to be RFC compliant")])
 
 
+@pytest.mark.asyncio
+async def test_boot_single_loop_split_lines(mocker, mock_sleep, mock_handle_line):
+    irc = dreambot.frontend.irc.FrontendIRC(
+        {
+            "host": "abc123",
+            "port": "1234",
+            "ssl": False,
+            "nickname": "abc",
+            "channels": ["#test1", "#test2"],
+            "ident": "testident",
+            "realname": "testrealname",
+        },
+        {"output_dir": "/tmp", "triggers": [], "uri_base": "http://testuri/"},
+        None,
+    )
+
+    reader = AsyncMock()
+    reader.read.side_effect = [b"PING :one\r\nPING :tw", b"o\r\n", b"PING :three", b""]
+
+    writer = AsyncMock()
+    mocker.patch("asyncio.open_connection", return_value=(reader, writer))
+    mocker.patch("dreambot.frontend.irc.FrontendIRC.send_lines")
+
+    irc.should_reconnect = False
+    await irc.boot()
+
+    mock_handle_line.assert_has_calls([call(b"PING :one\r"), call(b"PING :two\r"), call(b"PING :three")])
+    assert mock_handle_line.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_boot_single_loop_line_too_long(mocker, mock_sleep, mock_handle_line):
+    irc = dreambot.frontend.irc.FrontendIRC(
+        {
+            "host": "abc123",
+            "port": "1234",
+            "ssl": False,
+            "nickname": "abc",
+            "channels": ["#test1", "#test2"],
+            "ident": "testident",
+            "realname": "testrealname",
+        },
+        {"output_dir": "/tmp", "triggers": [], "uri_base": "http://testuri/"},
+        None,
+    )
+
+    reader = AsyncMock()
+    reader.read.side_effect = [b"PING :one\r\n" + b"x" * 65536, b"x", b"never read\r\n"]
+
+    writer = AsyncMock()
+    mocker.patch("asyncio.open_connection", return_value=(reader, writer))
+    mocker.patch("dreambot.frontend.irc.FrontendIRC.send_lines")
+    mocker.patch.object(irc.logger, "error")
+
+    irc.should_reconnect = False
+    await irc.boot()
+
+    mock_handle_line.assert_called_once_with(b"PING :one\r")
+    assert reader.read.call_count == 2
+    irc.logger.error.assert_called_once_with("IRC connection error: %s", mocker.ANY)
+    writer.close.assert_called_once()
+
+
 @pytest.mark.asyncio
 async def test_boot_single_loop_with_reply(mocker, mock_sleep):
     irc = dreambot.frontend.irc.FrontendIRC(
@@ -622,16 +746,10 @@ async def test_boot_single_loop_with_reply(mocker, mock_sleep):
     writer.assert_has_calls(
         [
             call.__bool__(),
-            call.write(b"NICK abc\r\n"),
-            call.drain(),
-            call.__bool__(),
-            call.write(b"USER testident * * :testrealname\r\n"),
-            call.drain(),
-            call.__bool__(),
-            call.write(b"JOIN #test1\r\n"),
+            call.write(b"NICK abc\r\nUSER testident * * :testrealname\r\n"),
             call.drain(),
             call.__bool__(),
-            call.write(b"JOIN #test2\r\n"),
+            call.write(b"JOIN #test1,#test2\r\n"),
             call.drain(),
             call.__bool__(),
             call.close(),
@@ -695,7 +813,7 @@ async def test_boot_reconnect_ConnectionResetError(mocker, mock_sleep):
     reconnect_count = 5
     reader = AsyncMock()
 
-    async def mock_readline():
+    async def mock_read(_):
         nonlocal reconnect_count
         nonlocal irc
         reconnect_count -= 1
@@ -703,8 +821,7 @@ async def test_boot_reconnect_ConnectionResetError(mocker, mock_sleep):
             irc.should_reconnect = False
         raise ConnectionResetError
 
-    reader.readline = AsyncMock(side_effect=mock_readline)
-    reader.at_eof = MagicMock(return_value=False)
+    reader.read = AsyncMock(side_effect=mock_read)
 
     writer = AsyncMock()
     writer.wait_closed = AsyncMock()
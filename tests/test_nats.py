@@ -212,3 +212,130 @@ async def test_nats_subscribe_other_exception(mocker, mock_sleep):
     await nm.subscribe(MagicMock())
     assert loop_count == 0
     assert nm.logger.error.call_count == 10
+
+
+@pytest.mark.asyncio
+async def test_nats_process_message():
+    nm = dreambot.shared.nats.NatsManager(nats_uri="nats://test:1234", name="test_nats_process_message")
+    worker = TestWorker()
+    msg = AsyncMock()
+
+    worker.callback_receive_workload = AsyncMock(return_value=True)
+    await nm.process_message(worker, "backend.test_worker", msg, {"foo": "bar"})
+    worker.callback_receive_workload.assert_called_once_with("backend.test_worker", {"foo": "bar"})
+    assert msg.ack.call_count == 1
+
+    # Messages the worker can't handle right now must stay in the queue
+    worker.callback_receive_workload = AsyncMock(return_value=False)
+    await nm.process_message(worker, "backend.test_worker", msg, {"foo": "bar"})
+    assert msg.ack.call_count == 1
+
+    # Messages that make the worker explode are discarded
+    worker.callback_receive_workload = AsyncMock(side_effect=ValueError("boom"))
+    await nm.process_message(worker, "backend.test_worker", msg, {"foo": "bar"})
+    assert msg.ack.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_nats_process_message_in_progress():
+    nm = dreambot.shared.nats.NatsManager(nats_uri="nats://test:1234", name="test_nats_process_message_in_progress")
+    nm.in_progress_interval = 0.01
+    worker = TestWorker()
+    msg = AsyncMock()
+
+    async def slow_workload(subject, msg_dict):
+        await asyncio.sleep(0.05)
+        return True
+
+    worker.callback_receive_workload = slow_workload
+    await nm.process_message(worker, "backend.test_worker", msg, {"foo": "bar"})
+    in_progress_count = msg.in_progress.call_count
+    assert in_progress_count >= 1
+    assert msg.ack.call_count == 1
+
+    # The heartbeat stops once the message has been handled
+    await asyncio.sleep(0.05)
+    assert msg.in_progress.call_count == in_progress_count
+
+
+@pytest.mark.asyncio
+async def test_nats_subscribe_concurrency():
+    nm = dreambot.shared.nats.NatsManager(nats_uri="nats://test:1234", name="test_nats_subscribe_concurrency")
+    nm.jets = AsyncMock()
+    nm.jsm = AsyncMock()
+
+    worker = TestWorker()
+    worker.is_booted = True
+    worker.max_concurrency = 2
+
+    in_progress = 0
+    max_in_progress = 0
+    processed = 0
+    release = asyncio.Event()
+
+    async def callback(queue_name, message):
+        nonlocal in_progress, max_in_progress, processed
+        in_progress += 1
+        max_in_progress = max(max_in_progress, in_progress)
+        if in_progress == worker.max_concurrency:
+            release.set()
+        await release.wait()
+        in_progress -= 1
+        processed += 1
+        if processed == 4:
+            nm.shutting_down = True
+        return True
+
+    worker.callback_receive_workload = callback
+
+    async def next_msg():
+        msg = AsyncMock()
+        msg.data = b'{"foo": "bar"}'
+        return msg
+
+    sub = AsyncMock()
+    sub.next_msg = next_msg
+    nm.jets.subscribe = AsyncMock(return_value=sub)
+
+    await asyncio.wait_for(nm.subscribe(worker), timeout=5)
+    assert max_in_progress == 2
+    assert processed >= 4
+
+
+@pytest.mark.asyncio
+async def test_nats_subscribe_undecodable():
+    nm = dreambot.shared.nats.NatsManager(nats_uri="nats://test:1234", name="test_nats_subscribe_undecodable")
+    nm.jets = AsyncMock()
+    nm.jsm = AsyncMock()
+
+    worker = TestWorker()
+    worker.is_booted = True
+    worker.callback_receive_workload = AsyncMock(return_value=True)
+
+    msg = AsyncMock()
+    msg.data = b"not json"
+
+    async def next_msg():
+        nm.shutting_down = True
+        return msg
+
+    sub = AsyncMock()
+    sub.next_msg = next_msg
+    nm.jets.subscribe = AsyncMock(return_value=sub)
+
+    await asyncio.wait_for(nm.subscribe(worker), timeout=5)
+    assert msg.term.call_count == 1
+    assert msg.ack.call_count == 0
+    assert worker.callback_receive_workload.call_count == 0
+
+
+def test_nats_decode_message():
+    nm = dreambot.shared.nats.NatsManager(nats_uri="nats://test:1234", name="test_nats_decode_message")
+
+    assert nm.decode_message(b'{"reply-text": "hello"}') == {"reply-text": "hello"}
+
+    image = "A" * 4 * 1024 * 1024
+    assert nm.decode_message(f'{{"reply-image": "{image}", "user": "testuser"}}'.encode()) == {
+        "reply-image": image,
+        "user": "testuser",
+    }
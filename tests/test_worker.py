@@ -1,5 +1,8 @@
 # pylint: skip-file
+import io
+
 import pytest
+from PIL import Image
 import dreambot.shared.worker
 import dreambot.shared.custom_argparse
 
@@ -27,6 +30,62 @@ def test_clean_filename():
     assert worker.clean_filename("test&", replace="&", output_dir="/tmp/") == "test_.png"
 
 
+def test_clean_filename_caches_statvfs(mocker):
+    worker = dreambot.shared.worker.DreambotWorkerBase(
+        name="test_name",
+        end=dreambot.shared.worker.DreambotWorkerEndType.BACKEND,
+        options={"nats_queue_name": "foo"},
+        callback_send_workload=None,
+    )
+    statvfs = mocker.spy(dreambot.shared.worker.os, "statvfs")
+    assert worker.clean_filename("test one", output_dir="/tmp/") == "test_one.png"
+    assert worker.clean_filename("test two", output_dir="/tmp/") == "test_two.png"
+    assert statvfs.call_count == 1
+
+
+def test_resize_image():
+    worker = dreambot.shared.worker.DreambotWorkerBase(
+        name="test_name",
+        end=dreambot.shared.worker.DreambotWorkerEndType.BACKEND,
+        options={"nats_queue_name": "foo"},
+        callback_send_workload=None,
+    )
+    source = io.BytesIO()
+    Image.new("RGBA", (2000, 1000), (255, 0, 0, 128)).save(source, "PNG")
+
+    resized = Image.open(io.BytesIO(worker.resize_image(source.getvalue())))
+    assert resized.format == "JPEG"
+    assert resized.mode == "RGB"
+    assert resized.size == (512, 256)
+
+
+def test_match_trigger():
+    worker = dreambot.shared.worker.DreambotWorkerBase(
+        name="test_name",
+        end=dreambot.shared.worker.DreambotWorkerEndType.FRONTEND,
+        options={"triggers": {"!dream": "backend.dream", "!gpt": "backend.gpt"}},
+        callback_send_workload=None,
+    )
+    assert worker.match_trigger("!dream a cat in a hat") == ("!dream", "a cat in a hat")
+    assert worker.match_trigger("!gpt hello") == ("!gpt", "hello")
+    assert worker.match_trigger("!dreamer a cat") is None
+    assert worker.match_trigger("hello everyone") is None
+    assert worker.match_trigger("!dream") is None
+
+
+def test_match_trigger_with_spaces():
+    worker = dreambot.shared.worker.DreambotWorkerBase(
+        name="test_name",
+        end=dreambot.shared.worker.DreambotWorkerEndType.FRONTEND,
+        options={"triggers": {"!dream": "backend.dream", "hey bot": "backend.gpt"}},
+        callback_send_workload=None,
+    )
+    assert worker.match_trigger("!dream a cat in a hat") == ("!dream", "a cat in a hat")
+    assert worker.match_trigger("hey bot hello") == ("hey bot", "hello")
+    assert worker.match_trigger("hey everyone") is None
+    assert worker.triggers_are_words is False
+
+
 @pytest.mark.asyncio
 async def test_unimplemented():
     worker = dreambot.shared.worker.DreambotWorkerBase(